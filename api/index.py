@@ -1,109 +1,124 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request
 import os
-import json
 import hmac
-import hashlib
 import time
-import urllib.request
-import urllib.parse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from operator import itemgetter
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
 
 app = Flask(__name__)
 
+API_KEY = os.environ.get("BYBIT_API_KEY", "")
+API_SECRET_BYTES = os.environ.get("BYBIT_API_SECRET", "").encode()
+
+# Shared keep-alive session, reused across warm invocations
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=10))
+SESSION.headers.update({"User-Agent": "Mozilla/5.0", "Connection": "keep-alive"})
+
+EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
+OK_BODY = orjson.dumps({"ok": True})
+
+WALLET_PARAMS = "accountType=UNIFIED"
+POSITION_PARAMS = "category=linear"
+
+FUNDING_ROW = "{}. {} <code>{:<12}</code> {}{:.4f}%"
+TOP_BOTTOM_ROW = "{}. <code>{:<12}</code> {}{:.4f}%"
+
+# Zero rates never rank, so skip float() on Bybit's usual spellings of them
+ZERO_RATES = frozenset({"0", "-0", "0.0", "0.0000", "0.00000000"})
+
+TICKERS_TTL = 15
+_tickers_cache = {"expires": 0.0, "rates": []}
+_tickers_lock = threading.Lock()
+
 
 # ============ Bybit API ============
 
-def bybit_request(endpoint, params=None):
-    base_url = "https://api.bybit.com"
-    url = f"{base_url}{endpoint}"
-    if params:
-        url += "?" + urllib.parse.urlencode(params)
+def bybit_get(url, **kwargs):
+    response = SESSION.get(url, timeout=10, **kwargs)
+    if not response.ok:
+        raise Exception(f"HTTP Error {response.status_code}: {response.reason}")
 
-    req = urllib.request.Request(url)
-    req.add_header("User-Agent", "Mozilla/5.0")
+    data = orjson.loads(response.content)
+    if data.get("retCode") != 0:
+        raise Exception(data.get("retMsg"))
+    return data.get("result", {})
 
-    with urllib.request.urlopen(req, timeout=10) as response:
-        data = json.loads(response.read().decode())
-        if data.get("retCode") != 0:
-            raise Exception(data.get("retMsg"))
-        return data.get("result", {})
 
+def warm_up_connection():
+    try:
+        SESSION.head("https://api.bybit.com/v5/market/time", timeout=2)
+    except Exception:
+        pass
 
-def get_funding_rates(limit=50):
-    result = bybit_request("/v5/market/tickers", {"category": "linear"})
-    tickers = result.get("list", [])
 
+def bybit_request(endpoint, params=None):
+    return bybit_get(f"https://api.bybit.com{endpoint}", params=params)
+
+
+def parse_funding_rates(tickers):
     funding_list = []
     for ticker in tickers:
         funding_rate = ticker.get("fundingRate")
-        if funding_rate:
+        if funding_rate and funding_rate not in ZERO_RATES:
             rate = float(funding_rate)
-            funding_list.append({
-                "symbol": ticker.get("symbol", ""),
-                "funding_rate": rate,
-                "funding_rate_pct": rate * 100,
-                "abs_funding_rate": abs(rate)
-            })
+            funding_list.append((abs(rate), rate, ticker.get("symbol", "")))
+
+    funding_list.sort(key=itemgetter(0), reverse=True)
+    return funding_list
 
-    funding_list.sort(key=lambda x: x["abs_funding_rate"], reverse=True)
-    return funding_list[:limit]
 
+def get_all_funding_rates():
+    with _tickers_lock:
+        now = time.monotonic()
+        if now >= _tickers_cache["expires"]:
+            result = bybit_request("/v5/market/tickers", {"category": "linear"})
+            _tickers_cache["rates"] = parse_funding_rates(result.get("list", []))
+            _tickers_cache["expires"] = now + TICKERS_TTL
+        return _tickers_cache["rates"]
 
-def bybit_signed_request(endpoint, params):
-    api_key = os.environ.get("BYBIT_API_KEY", "")
-    api_secret = os.environ.get("BYBIT_API_SECRET", "")
 
-    if not api_key or not api_secret:
+def get_funding_rates(limit=50):
+    top = get_all_funding_rates()[:limit]
+    return [(rate, symbol) for _, rate, symbol in top]
+
+
+def bybit_signed_request(endpoint, param_str):
+    if not API_KEY or not API_SECRET_BYTES:
         raise Exception("API key not set")
 
     timestamp = str(int(time.time() * 1000))
     recv_window = "5000"
-    param_str = "&".join(f"{k}={v}" for k, v in sorted(params.items()))
 
-    sign_str = f"{timestamp}{api_key}{recv_window}{param_str}"
-    signature = hmac.new(
-        api_secret.encode(), sign_str.encode(), hashlib.sha256
-    ).hexdigest()
+    sign_str = f"{timestamp}{API_KEY}{recv_window}{param_str}"
+    signature = hmac.digest(API_SECRET_BYTES, sign_str.encode(), "sha256").hex()
 
     url = f"https://api.bybit.com{endpoint}?{param_str}"
-    req = urllib.request.Request(url)
-    req.add_header("X-BAPI-API-KEY", api_key)
-    req.add_header("X-BAPI-SIGN", signature)
-    req.add_header("X-BAPI-TIMESTAMP", timestamp)
-    req.add_header("X-BAPI-RECV-WINDOW", recv_window)
-    req.add_header("User-Agent", "Mozilla/5.0")
-
-    with urllib.request.urlopen(req, timeout=10) as response:
-        data = json.loads(response.read().decode())
-        if data.get("retCode") != 0:
-            raise Exception(data.get("retMsg"))
-        return data.get("result", {})
+    headers = {
+        "X-BAPI-API-KEY": API_KEY,
+        "X-BAPI-SIGN": signature,
+        "X-BAPI-TIMESTAMP": timestamp,
+        "X-BAPI-RECV-WINDOW": recv_window,
+    }
 
+    return bybit_get(url, headers=headers)
 
-# ============ Telegram ============
 
-def send_telegram(chat_id, text):
-    token = os.environ.get("TELEGRAM_BOT_TOKEN", "")
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
-
-    data = json.dumps({
-        "chat_id": chat_id,
-        "text": text,
-        "parse_mode": "HTML"
-    }).encode()
-
-    req = urllib.request.Request(url, data=data)
-    req.add_header("Content-Type", "application/json")
-
-    try:
-        with urllib.request.urlopen(req, timeout=10) as response:
-            return response.status == 200
-    except:
-        return False
+# ============ Commands ============
 
+def parse_limit(args, default, maximum):
+    limit = int(args) if args.strip().isdigit() else default
+    return min(limit, maximum)
 
-# ============ Commands ============
 
-def cmd_help(chat_id):
+def cmd_help(args):
     text = """<b>Bybit 펀딩비 봇</b>
 
 /funding [N] - 펀딩비 상위 N개
@@ -112,63 +127,65 @@ def cmd_help(chat_id):
 /bottom [N] - 음수 펀딩비 (숏 과열)
 /portfolio - 포트폴리오
 /help - 도움말"""
-    send_telegram(chat_id, text)
+    return text
 
 
-def cmd_funding(chat_id, args):
+def cmd_funding(args):
     try:
-        limit = int(args) if args.strip().isdigit() else 20
-        limit = min(limit, 50)
+        limit = parse_limit(args, 20, 50)
 
         funding_list = get_funding_rates(limit)
-        lines = [f"<b>펀딩비 상위 {limit}개</b>\n"]
-
-        for i, f in enumerate(funding_list[:limit], 1):
-            rate = f["funding_rate_pct"]
-            sign = "+" if rate > 0 else ""
-            emoji = "🔴" if rate < 0 else "🟢"
-            lines.append(f"{i}. {emoji} <code>{f['symbol']:<12}</code> {sign}{rate:.4f}%")
-
-        positive = sum(1 for f in funding_list[:limit] if f["funding_rate"] > 0)
-        negative = limit - positive
-        lines.append(f"\n🟢 롱과열: {positive}개 | 🔴 숏과열: {negative}개")
-
-        send_telegram(chat_id, "\n".join(lines))
+        lines = []
+        positive = 0
+        for i, (rate, symbol) in enumerate(funding_list, 1):
+            positive += rate > 0
+            lines.append(FUNDING_ROW.format(
+                i,
+                "🔴" if rate < 0 else "🟢",
+                symbol,
+                "+" if rate > 0 else "",
+                rate * 100,
+            ))
+        rows = "\n".join(lines)
+
+        count = len(funding_list)
+        negative = count - positive
+
+        return f"<b>펀딩비 상위 {count}개</b>\n\n{rows}\n\n🟢 롱과열: {positive}개 | 🔴 숏과열: {negative}개"
     except Exception as e:
-        send_telegram(chat_id, f"오류: {str(e)}")
+        return f"오류: {str(e)}"
 
 
-def cmd_top_bottom(chat_id, args, positive):
+def cmd_top_bottom(args, positive):
     try:
-        limit = int(args) if args.strip().isdigit() else 10
-        limit = min(limit, 30)
+        limit = parse_limit(args, 10, 30)
 
-        funding_list = get_funding_rates(200)
+        # Already sorted by |rate|, so the first matches are the largest
+        funding_list = get_all_funding_rates()
 
         if positive:
-            filtered = [f for f in funding_list if f["funding_rate"] > 0]
+            filtered = (f for f in funding_list if f[1] > 0)
             title = f"🟢 <b>양수 펀딩비 상위 {limit}개</b>"
         else:
-            filtered = [f for f in funding_list if f["funding_rate"] < 0]
+            filtered = (f for f in funding_list if f[1] < 0)
             title = f"🔴 <b>음수 펀딩비 상위 {limit}개</b>"
 
-        filtered.sort(key=lambda x: abs(x["funding_rate"]), reverse=True)
-
-        lines = [title + "\n"]
-        for i, f in enumerate(filtered[:limit], 1):
-            rate = f["funding_rate_pct"]
-            sign = "+" if rate > 0 else ""
-            lines.append(f"{i}. <code>{f['symbol']:<12}</code> {sign}{rate:.4f}%")
+        rows = "\n".join(
+            TOP_BOTTOM_ROW.format(i, symbol, "+" if rate > 0 else "", rate * 100)
+            for i, (_, rate, symbol) in enumerate(islice(filtered, limit), 1)
+        )
 
-        send_telegram(chat_id, "\n".join(lines))
+        return f"{title}\n\n{rows}"
     except Exception as e:
-        send_telegram(chat_id, f"오류: {str(e)}")
+        return f"오류: {str(e)}"
 
 
-def cmd_portfolio(chat_id):
+def cmd_portfolio(args):
     try:
-        wallet = bybit_signed_request("/v5/account/wallet-balance", {"accountType": "UNIFIED"})
-        positions = bybit_signed_request("/v5/position/list", {"category": "linear"}).get("list", [])
+        f_wallet = EXECUTOR.submit(bybit_signed_request, "/v5/account/wallet-balance", WALLET_PARAMS)
+        f_pos = EXECUTOR.submit(bybit_signed_request, "/v5/position/list", POSITION_PARAMS)
+        wallet = f_wallet.result()
+        positions = f_pos.result().get("list", [])
 
         lines = ["<b>📊 포트폴리오</b>\n"]
 
@@ -194,9 +211,21 @@ def cmd_portfolio(chat_id):
         else:
             lines.append("포지션 없음")
 
-        send_telegram(chat_id, "\n".join(lines))
+        return "\n".join(lines)
     except Exception as e:
-        send_telegram(chat_id, f"오류: {str(e)}")
+        return f"오류: {str(e)}"
+
+
+COMMANDS = {
+    "/start": cmd_help,
+    "/help": cmd_help,
+    "/funding": cmd_funding,
+    "/f": cmd_funding,
+    "/top": partial(cmd_top_bottom, positive=True),
+    "/bottom": partial(cmd_top_bottom, positive=False),
+    "/portfolio": cmd_portfolio,
+    "/p": cmd_portfolio,
+}
 
 
 def handle_message(message):
@@ -204,22 +233,24 @@ def handle_message(message):
     text = message.get("text", "")
 
     if not chat_id or not text:
-        return
+        return None
 
     parts = text.split(maxsplit=1)
     command = parts[0].lower().split("@")[0]
     args = parts[1] if len(parts) > 1 else ""
 
-    if command in ["/start", "/help"]:
-        cmd_help(chat_id)
-    elif command in ["/funding", "/f"]:
-        cmd_funding(chat_id, args)
-    elif command == "/top":
-        cmd_top_bottom(chat_id, args, positive=True)
-    elif command == "/bottom":
-        cmd_top_bottom(chat_id, args, positive=False)
-    elif command in ["/portfolio", "/p"]:
-        cmd_portfolio(chat_id)
+    fn = COMMANDS.get(command)
+    if not fn:
+        return None
+
+    # Reply in the webhook response so Telegram delivers it without a
+    # separate sendMessage round-trip from this function.
+    return {
+        "method": "sendMessage",
+        "chat_id": chat_id,
+        "text": fn(args),
+        "parse_mode": "HTML"
+    }
 
 
 # ============ Routes ============
@@ -240,11 +271,17 @@ def webhook():
         return "Webhook OK"
 
     try:
-        update = request.get_json()
+        update = orjson.loads(request.get_data())
         message = update.get("message", {})
         if message:
-            handle_message(message)
+            reply = handle_message(message)
+            if reply:
+                return Response(orjson.dumps(reply), mimetype="application/json")
     except Exception as e:
         print(f"Error: {e}")
 
-    return jsonify({"ok": True})
+    return Response(OK_BODY, mimetype="application/json")
+
+
+# Open the Bybit TLS connection while the cold start finishes importing
+EXECUTOR.submit(warm_up_connection)